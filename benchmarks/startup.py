@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the server and client
+
+Measures, over several runs:
+- time-to-listen: from launching the server until it accepts connections
+- time-to-first-ack: from connecting to a fresh server until the first batch is acknowledged,
+  which includes starting its first handler process
+- time-to-first-batch: from launching a client until its first batch reaches the server
+
+Exits with status 1 if the median of any measure is over its budget.
+Run from the repository root: python3 benchmarks/startup.py
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import shutil
+import zipfile
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.network import MINTSocket
+from lib.serde import Message, AckPayload, BetPayload
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def component_env(component, **env):
+    return dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, component)]), **env)
+
+
+def wait_for_listen(port, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with status {process.returncode}')
+        try:
+            with socket.create_connection(('localhost', port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.001)
+    raise TimeoutError('Server did not start listening')
+
+
+def stop(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def measure_server(workdir):
+    """
+    Returns the time-to-listen and time-to-first-ack of a fresh server, in seconds
+    """
+    port = free_port()
+    env = component_env('server', SERVER_PORT=str(port), LOGGING_LEVEL='WARNING')
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server', 'main.py')], cwd=workdir, env=env,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_listen(port, server)
+        time_to_listen = time.perf_counter() - start
+        # the connection used to detect the listening socket starts a handler that fails to read,
+        # leave it some time so it doesn't overlap with the measured one
+        time.sleep(0.05)
+        batch = Message(Message.MSG_BET, [BetPayload(1, 'first', 'last', '10000000', '2000-12-20', '7500')])
+        start = time.perf_counter()
+        client = MINTSocket()
+        client.connect(('localhost', port))
+        client.send(batch)
+        ack = client.recv()
+        time_to_first_ack = time.perf_counter() - start
+        client.close()
+        if ack.kind != Message.MSG_ACK:
+            raise RuntimeError(f'Unexpected message kind "{ack.kind}"')
+        return time_to_listen, time_to_first_ack
+    finally:
+        stop(server)
+
+
+def measure_client(workdir):
+    """
+    Returns the time-to-first-batch of a fresh client, in seconds
+    """
+    listener = MINTSocket()
+    listener.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    port = listener.socket.getsockname()[1]
+    env = component_env('client', CLI_ID='1', CLI_SERVER_ADDRESS=f'localhost:{port}', CLI_LOG_LEVEL='WARNING')
+    start = time.perf_counter()
+    client = subprocess.Popen([sys.executable, os.path.join(ROOT, 'client', 'main.py')], cwd=workdir, env=env,
+                              stderr=subprocess.DEVNULL)
+    try:
+        conn, _ = listener.accept()
+        msg = Message.deserialize(conn.recv_bytes())
+        time_to_first_batch = time.perf_counter() - start
+        conn.send(Message(Message.MSG_ACK, [AckPayload(bet.data['document'], bet.data['number']) for bet in msg.data]))
+        conn.close()
+        return time_to_first_batch
+    finally:
+        listener.close()
+        stop(client)
+
+
+def prepare_workdirs(tmpdir, dataset):
+    server_dir = os.path.join(tmpdir, 'server')
+    client_dir = os.path.join(tmpdir, 'client')
+    os.makedirs(server_dir)
+    os.makedirs(client_dir)
+    shutil.copy(os.path.join(ROOT, 'server', 'config.ini'), server_dir)
+    shutil.copy(os.path.join(ROOT, 'client', 'config.ini'), client_dir)
+    with zipfile.ZipFile(dataset) as archive, open(os.path.join(client_dir, 'agency.csv'), 'wb') as agency:
+        agency.write(archive.read('agency-1.csv'))
+    return server_dir, client_dir
+
+
+def report(name, samples, budget_ms):
+    median = statistics.median(samples) * 1000
+    status = 'ok' if median <= budget_ms else 'over_budget'
+    print(f'action: startup_benchmark | measure: {name} | runs: {len(samples)} | median_ms: {median:.1f} | '
+          f'min_ms: {min(samples) * 1000:.1f} | max_ms: {max(samples) * 1000:.1f} | budget_ms: {budget_ms} | result: {status}')
+    return median <= budget_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--dataset', default=os.path.join(ROOT, '.data', 'dataset.zip'))
+    parser.add_argument('--budget-listen-ms', type=float, default=150)
+    parser.add_argument('--budget-first-ack-ms', type=float, default=50)
+    parser.add_argument('--budget-first-batch-ms', type=float, default=150)
+    args = parser.parse_args()
+
+    listen, first_ack, first_batch = [], [], []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server_dir, client_dir = prepare_workdirs(tmpdir, args.dataset)
+        for _ in range(args.runs):
+            time_to_listen, time_to_first_ack = measure_server(server_dir)
+            listen.append(time_to_listen)
+            first_ack.append(time_to_first_ack)
+            first_batch.append(measure_client(client_dir))
+
+    within_budget = all([
+        report('time_to_listen', listen, args.budget_listen_ms),
+        report('time_to_first_ack', first_ack, args.budget_first_ack_ms),
+        report('time_to_first_batch', first_batch, args.budget_first_batch_ms),
+    ])
+    sys.exit(0 if within_budget else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+""" Max size of a serialized bet, payload sizes are sent as a single byte. """
+MAX_BET_SIZE = 255
+
+
+class AdaptiveBatchSize:
+    """
+    Picks the amount of bytes of the bets file to send in each batch, within [min_size, max_size].
+
+    The size starts at min_size and is adjusted after every acknowledged batch by comparing the
+    throughput of that batch against a moving average of previous ones: it keeps growing while
+    throughput improves and shrinks when it degrades. Backpressure signaled by the server halves it.
+    With min_size == max_size the batch size is fixed.
+    """
+    GROWTH_FACTOR = 1.5
+    SHRINK_FACTOR = 0.8
+    BACKPRESSURE_FACTOR = 0.5
+    # weight of the last batch in the throughput moving average
+    SMOOTHING = 0.3
+    # relative throughput drop tolerated before shrinking, to avoid reacting to noise
+    TOLERANCE = 0.1
+
+    def __init__(self, min_size: int, max_size: int):
+        if min_size > max_size:
+            raise ValueError(f'Min batch size {min_size} is greater than max batch size {max_size}')
+        if min_size < 2 * MAX_BET_SIZE:
+            raise ValueError(f'Min batch size {min_size} is too small, must be at least {2 * MAX_BET_SIZE}')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = min_size
+        self.throughput = None
+
+    def on_ack(self, batch_bytes: int, elapsed: float):
+        """
+        Update the batch size with the time it took to send a batch and receive its ACK
+        """
+        throughput = batch_bytes / max(elapsed, 1e-6)
+        if self.throughput is None or throughput >= self.throughput:
+            self._resize(self.GROWTH_FACTOR)
+        elif throughput < self.throughput * (1 - self.TOLERANCE):
+            self._resize(self.SHRINK_FACTOR)
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = self.SMOOTHING * throughput + (1 - self.SMOOTHING) * self.throughput
+
+    def on_backpressure(self):
+        """
+        Shrink the batch size after the server asked to slow down
+        """
+        self._resize(self.BACKPRESSURE_FACTOR)
+        # throughput measured before the server got overloaded is no longer a valid reference
+        self.throughput = None
+
+    def _resize(self, factor: float):
+        self.size = min(self.max_size, max(self.min_size, int(self.size * factor)))
@@ -1,9 +1,11 @@
 import time
 import signal
 import logging
+from contextlib import nullcontext
 from io import BufferedReader
 from lib.serde import Message, FinPayload, QueryPayload
 from lib.network import MINTSocket
+from .batching import AdaptiveBatchSize
 
 def signal_handler(signalnum, _stack_frame):
     if signalnum == signal.SIGALRM:
@@ -20,7 +22,9 @@ class Client:
         self.loop_lapse = config['loop_lapse']
         self.loop_period = config['loop_period']
         self.id = config['client_id']
-        self.batch_max_size = config['batch_max_size']
+        self.batch_size = AdaptiveBatchSize(config['batch_min_size'], config['batch_max_size'])
+        # None unless profiling is enabled
+        self.profiler = config['profiler']
         self.socket = MINTSocket()
 
     def run(self):
@@ -30,6 +34,8 @@ class Client:
         """
         signal.signal(signal.SIGALRM, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+        if self.profiler:
+            self.profiler.start()
         try:
             with open(f'agency.csv', 'rb') as betsfile:
                 self.send_bets_to_server(BufferedReader(betsfile))
@@ -40,12 +46,24 @@ class Client:
         finally:
             self.socket.close()
             logging.debug(f"action: close_socket | result: success | client_id: {self.id}")
+            if self.profiler:
+                self.profiler.stop('main')
+                self.profiler.report()
+
+
+    def stage(self, name):
+        """
+        Context manager that times a stage of the client when profiling is enabled
+        """
+        return self.profiler.stage(name) if self.profiler else nullcontext()
 
 
     def send_bets_to_server(self, bets_reader):
         """
         Client message loop
         Send messages to the server until a time threshold is met
+        The size of each batch is picked by an AdaptiveBatchSize from the time it took to send previous
+        batches, batches rejected by the server are sent again after the delay it requested.
         """
         self.buffer = b''
         try:
@@ -53,21 +71,28 @@ class Client:
             signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
             # set alarm to break out of the while loop
             signal.alarm(self.loop_lapse)
-            while (bytes_read := bets_reader.read(self.batch_max_size - len(self.buffer))):
-                self.buffer += bytes_read
-                bets = [bet.rstrip() for bet in self.buffer.split(b'\n')]
-                # assume that it didn't finish reading bets, the last item in the list is incomplete
-                # the file is newline terminated so there's no need to consume the last element after the last iteration
-                self.buffer = bets[-1]
-                bets = bets[:-1]
-                batch = Message.from_csv(bets, self.id)
-                self.connect_to_server()
-                self.send_message(batch)
-                self.recv_ack_message(batch)
-                self.socket.close()
-                time.sleep(self.loop_period)
-                if len(self.buffer) == self.batch_max_size:
-                    raise ValueError('BATCH_MAX_SIZE is too small to read a single bet')
+            while True:
+                batch_size = self.batch_size.size
+                with self.stage('read'):
+                    bytes_read = bets_reader.read(batch_size - len(self.buffer))
+                if not bytes_read:
+                    break
+                with self.stage('build'):
+                    self.buffer += bytes_read
+                    batch_bytes = len(self.buffer)
+                    bets = [bet.rstrip() for bet in self.buffer.split(b'\n')]
+                    # assume that it didn't finish reading bets, the last item in the list is incomplete
+                    # the file is newline terminated so there's no need to consume the last element after the last iteration
+                    self.buffer = bets[-1]
+                    bets = bets[:-1]
+                    batch_bytes -= len(self.buffer)
+                    batch = Message.from_csv(bets, self.id)
+                if bets:
+                    self.send_batch(batch, batch_bytes)
+                if self.loop_period:
+                    time.sleep(self.loop_period)
+                if len(self.buffer) == batch_size:
+                    raise ValueError('BATCH_MIN_SIZE is too small to read a single bet')
             # clear alarm to avoid interrupting process once the loop is complete
             signal.alarm(0)
         except TimeoutError:
@@ -75,6 +100,26 @@ class Client:
             logging.info(f"action: loop_finished | result: success | client_id: {self.id}")
 
 
+    def send_batch(self, batch, batch_bytes):
+        """
+        Send a batch of bets until the server acknowledges it, waiting between attempts as long as
+        the server requested. The time taken by each attempt is used to adapt the batch size.
+        """
+        while True:
+            start = time.monotonic()
+            self.connect_to_server()
+            self.send_message(batch)
+            with self.stage('ack'):
+                retry_after = self.recv_ack_message(batch)
+            self.socket.close()
+            if retry_after is None:
+                self.batch_size.on_ack(batch_bytes, time.monotonic() - start)
+                return
+            logging.debug(f'action: backpressure | result: success | client_id: {self.id} | retry_after: {retry_after}')
+            self.batch_size.on_backpressure()
+            time.sleep(retry_after)
+
+
     def get_lottery_winners(self):
         self.connect_to_server()
         self.send_message(Message(Message.MSG_FIN, [FinPayload(self.id)]))
@@ -97,9 +142,15 @@ class Client:
 
 
     def recv_ack_message(self, batch):
+        """
+        Receive the ACK of a batch. If the server rejected the batch, return the
+        seconds to wait before sending it again, otherwise return None.
+        """
         try:
             msg = self.socket.recv()
-            if msg.kind == Message.MSG_ACK:
+            if msg.kind == Message.MSG_RETRY:
+                return int(msg.data[0].data['retry_after_ms']) / 1000
+            elif msg.kind == Message.MSG_ACK:
                 for idx, ack_msg in enumerate(msg.data):
                     if ack_msg.data['document'] != batch.data[idx].data['document'] or ack_msg.data['number'] != batch.data[idx].data['number']:
                         raise ValueError(f'Ack {ack_msg.data} doesnt match bet {batch.data[idx].data} in batch position {idx}')
@@ -133,7 +184,10 @@ class Client:
         client socket will also be closed
         """
         try:
-            self.socket.send(msg)
+            with self.stage('serialize'):
+                byte_list = msg.serialize()
+            with self.stage('send'):
+                self.socket.send_bytes(byte_list)
         except OSError as e:
             self.socket.close()
             logging.error(f"action: send_message | result: fail | error: {e}")
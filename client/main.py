@@ -35,7 +35,14 @@ def initialize_config():
         config_params["loop_period"] = int(os.getenv('CLI_LOOP_PERIOD_SECONDS', config["DEFAULT"]["LOOP_PERIOD_SECONDS"]))
         config_params["log_level"] = os.getenv('CLI_LOG_LEVEL', config["DEFAULT"]["LOG_LEVEL"])
         config_params["client_id"] = os.getenv('CLI_ID', config["DEFAULT"]["CLI_ID"])
+        config_params["batch_min_size"] = int(os.getenv('CLI_BATCH_MIN_SIZE', config["DEFAULT"]["BATCH_MIN_SIZE"]))
         config_params["batch_max_size"] = int(os.getenv('CLI_BATCH_MAX_SIZE', config["DEFAULT"]["BATCH_MAX_SIZE"]))
+        config_params["profiling"] = os.getenv('CLI_PROFILING', config["DEFAULT"]["PROFILING"]).strip()
+        if config_params["profiling"]:
+            # only import the profiler when it is going to be used, to keep the client startup short
+            from lib.profiling import Profiler
+            config_params["profiling"] = Profiler.parse_modes(config_params["profiling"])
+        config_params["profiling_dir"] = os.getenv('CLI_PROFILING_DIR', config["DEFAULT"]["PROFILING_DIR"])
     except KeyError as e:
         raise KeyError("Key was not found. Error: {} .Aborting client".format(e))
     except ValueError as e:
@@ -49,18 +56,22 @@ def main():
     server_host = config_params["server_host"]
     server_port = config_params["server_port"]
     client_id = config_params["client_id"]
+    batch_min_size = config_params["batch_min_size"]
     batch_max_size = config_params["batch_max_size"]
     loop_lapse = config_params["loop_lapse"]
     loop_period = config_params["loop_period"]
     log_level = config_params["log_level"]
+    profiling = config_params["profiling"]
+    profiling_dir = config_params["profiling_dir"]
 
     initialize_log(log_level)
 
     # Log config parameters at the beginning of the program to verify the configuration
     # of the component
-    logging.debug(f"action: config | result: success | client_id: {client_id} | batch_max_size: {batch_max_size}"
+    logging.debug(f"action: config | result: success | client_id: {client_id} | batch_min_size: {batch_min_size} | batch_max_size: {batch_max_size}"
         f" | server_address: {server_host}:{server_port} | loop_lapse: {loop_lapse}"
         f" | loop_period: {loop_period} | log_level: {log_level}"
+        f" | profiling: {profiling} | profiling_dir: {profiling_dir}"
     )
 
     # BLOCK SIGTERM signals to process them later.
@@ -69,6 +80,12 @@ def main():
     # have to be allocated before the try/except block
     signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
     del config_params['log_level']
+    config_params['profiler'] = None
+    if profiling:
+        from lib.profiling import Profiler
+        config_params['profiler'] = Profiler(f'client-{client_id}', profiling, profiling_dir)
+    del config_params['profiling']
+    del config_params['profiling_dir']
     client = Client(config_params)
     client.run()
 
@@ -0,0 +1,61 @@
+from common.batching import AdaptiveBatchSize, MAX_BET_SIZE
+import unittest
+
+class TestAdaptiveBatchSize(unittest.TestCase):
+
+    def test_on_ack_grows_size_while_throughput_improves(self):
+        batch_size = AdaptiveBatchSize(1024, 8192)
+        batch_size.on_ack(1024, 1.0)
+        self.assertEqual(1536, batch_size.size)
+        batch_size.on_ack(1536, 1.0)
+        self.assertEqual(2304, batch_size.size)
+
+    def test_on_ack_shrinks_size_when_throughput_drops(self):
+        batch_size = AdaptiveBatchSize(1024, 8192)
+        batch_size.on_ack(1024, 1.0)
+        batch_size.on_ack(1536, 1.0)
+        batch_size.on_ack(100, 1.0)
+        self.assertEqual(int(2304 * AdaptiveBatchSize.SHRINK_FACTOR), batch_size.size)
+
+    def test_on_ack_keeps_size_on_small_throughput_drops(self):
+        batch_size = AdaptiveBatchSize(1024, 8192)
+        batch_size.on_ack(1000, 1.0)
+        batch_size.on_ack(950, 1.0)
+        self.assertEqual(1536, batch_size.size)
+
+    def test_size_is_clamped_to_bounds(self):
+        batch_size = AdaptiveBatchSize(1024, 2048)
+        for size in range(1, 10):
+            batch_size.on_ack(size * 1000, 1.0)
+        self.assertEqual(2048, batch_size.size)
+        batch_size.on_ack(1, 1.0)
+        batch_size.on_ack(1, 1.0)
+        batch_size.on_ack(1, 1.0)
+        batch_size.on_ack(1, 1.0)
+        self.assertEqual(1024, batch_size.size)
+
+    def test_on_backpressure_halves_size(self):
+        batch_size = AdaptiveBatchSize(1024, 8192)
+        batch_size.on_ack(1024, 1.0)
+        batch_size.on_ack(1536, 1.0)
+        batch_size.on_backpressure()
+        self.assertEqual(1152, batch_size.size)
+        batch_size.on_backpressure()
+        self.assertEqual(1024, batch_size.size)
+
+    def test_equal_bounds_keep_size_fixed(self):
+        batch_size = AdaptiveBatchSize(4096, 4096)
+        batch_size.on_ack(4096, 1.0)
+        batch_size.on_ack(1, 1.0)
+        batch_size.on_backpressure()
+        self.assertEqual(4096, batch_size.size)
+
+    def test_init_rejects_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            AdaptiveBatchSize(2048, 1024)
+        with self.assertRaises(ValueError):
+            AdaptiveBatchSize(2 * MAX_BET_SIZE - 1, 8192)
+        AdaptiveBatchSize(2 * MAX_BET_SIZE, 8192)
+
+if __name__ == '__main__':
+    unittest.main()
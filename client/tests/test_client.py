@@ -0,0 +1,69 @@
+from common.client import Client
+from lib.serde import Message, AckPayload, RetryPayload
+import unittest
+from unittest import mock
+
+class FakeSocket:
+    """
+    Socket that answers every message it receives with the next of responses, through the wire format
+    """
+    def __init__(self, sent, responses):
+        self.sent = sent
+        self.responses = responses
+
+    def connect(self, _address):
+        pass
+
+    def send_bytes(self, data):
+        self.sent.append(Message.deserialize(data))
+
+    def recv(self):
+        return Message.deserialize(self.responses.pop(0).serialize())
+
+    def close(self):
+        pass
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.responses = []
+        patcher = mock.patch('common.client.MINTSocket', side_effect=lambda: FakeSocket(self.sent, self.responses))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client({
+            'server_host': 'localhost',
+            'server_port': 12345,
+            'loop_lapse': 1,
+            'loop_period': 0,
+            'client_id': '1',
+            'batch_min_size': 1024,
+            'batch_max_size': 8192,
+            'profiler': None,
+        })
+
+    def test_send_batch_resends_after_the_delay_requested_by_the_server(self):
+        batch = Message.from_csv([b'first,last,10000000,2000-12-20,7500'], '1')
+        self.responses.extend([
+            Message(Message.MSG_RETRY, [RetryPayload(250)]),
+            Message(Message.MSG_ACK, [AckPayload('10000000', '7500')]),
+        ])
+        with mock.patch('common.client.time.sleep') as sleep:
+            self.client.send_batch(batch, 36)
+        sleep.assert_called_once_with(0.25)
+        self.assertEqual(2, len(self.sent))
+        for msg in self.sent:
+            self.assertEqual(Message.MSG_BET, msg.kind)
+            self.assertEqual(batch.data[0].serialize(), msg.data[0].serialize())
+        self.assertEqual([], self.responses)
+
+    def test_send_batch_without_retry_does_not_wait(self):
+        batch = Message.from_csv([b'first,last,10000000,2000-12-20,7500'], '1')
+        self.responses.append(Message(Message.MSG_ACK, [AckPayload('10000000', '7500')]))
+        with mock.patch('common.client.time.sleep') as sleep:
+            self.client.send_batch(batch, 36)
+        sleep.assert_not_called()
+        self.assertEqual(1, len(self.sent))
+
+if __name__ == '__main__':
+    unittest.main()
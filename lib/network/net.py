@@ -46,20 +46,30 @@ class MINTSocket:
             buffer.extend(read_bytes)
         return bytes(buffer)
 
-    def recv(self):
+    def recv_bytes(self):
         """
+        Read a single message from the peer without deserializing it
         """
         # max msg size supported is uint_32 max
         buffer = self.recv_sized(4)
         size = uint32_from_be(buffer)
-        buffer = self.recv_sized(size)
-        return Message.deserialize(buffer)
+        return self.recv_sized(size)
 
-    def send(self, payload):
-        byte_list = payload.serialize()
+    def recv(self):
+        """
+        """
+        return Message.deserialize(self.recv_bytes())
+
+    def send_bytes(self, byte_list):
+        """
+        Send an already serialized message to the peer
+        """
         size_bytes = int_to_be(len(byte_list))
         return self.socket.sendall(size_bytes + byte_list)
 
+    def send(self, payload):
+        return self.send_bytes(payload.serialize())
+
 
     def close(self):
         return self.socket.close()
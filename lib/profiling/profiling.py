@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+
+
+class _Stage:
+    """
+    Context manager that adds the time spent inside it to the stats of a stage
+    """
+    __slots__ = ('stats', 'start')
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc_info):
+        elapsed = time.perf_counter() - self.start
+        stats = self.stats
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        return False
+
+
+class _NullStage:
+    """
+    Context manager used for every stage when timers are disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Opt-in profiler for the main stages of a client or server.
+    Modes can be any combination of TIMERS, CPROFILE and TRACEMALLOC, with no modes the profiler
+    does nothing and stages cost a single method call.
+    Stats of processes forked after calling share() are accumulated in shared memory, so the
+    process that created the profiler can report them all at shutdown.
+    """
+    TIMERS = 'timers'
+    CPROFILE = 'cprofile'
+    TRACEMALLOC = 'tracemalloc'
+    # amount of stats kept per stage: count, total seconds and max seconds
+    STATS_LEN = 3
+
+    def __init__(self, name: str, modes=(), output_dir: str = '.'):
+        self.name = name
+        self.modes = set(modes)
+        unsupported = self.modes - {self.TIMERS, self.CPROFILE, self.TRACEMALLOC}
+        if unsupported:
+            raise ValueError(f'Unsupported profiling modes {unsupported}')
+        self.output_dir = output_dir
+        self.stats = {}
+        self.shared = None
+        self.shared_stages = ()
+        self._cprofile = None
+
+    @classmethod
+    def parse_modes(cls, modes: str) -> list:
+        """
+        Parses a comma separated list of modes, as found in config files.
+        Raises ValueError if a mode is not supported.
+        """
+        parsed = [mode.strip() for mode in modes.split(',') if mode.strip()]
+        unsupported = set(parsed) - {cls.TIMERS, cls.CPROFILE, cls.TRACEMALLOC}
+        if unsupported:
+            raise ValueError(f'Unsupported profiling modes {unsupported}')
+        return parsed
+
+    def stage(self, name: str):
+        """
+        Returns a context manager that times the code inside it as part of the given stage
+        """
+        if self.TIMERS not in self.modes:
+            return _NULL_STAGE
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0.0, 0.0]
+        return _Stage(stats)
+
+    def share(self, stages, ctx=None):
+        """
+        Allocates shared memory for the given stages. Must be called before starting processes
+        that will call flush(), using the same multiprocessing context.
+        """
+        if self.TIMERS not in self.modes:
+            return
+        if ctx is None:
+            import multiprocessing as ctx
+        self.shared_stages = tuple(stages)
+        self.shared = ctx.Array('d', self.STATS_LEN * len(self.shared_stages))
+
+    def flush(self):
+        """
+        Moves the stats of shared stages collected by this process into shared memory
+        """
+        if self.shared is None:
+            return
+        with self.shared.get_lock():
+            for idx, stage in enumerate(self.shared_stages):
+                stats = self.stats.pop(stage, None)
+                if stats is None:
+                    continue
+                offset = idx * self.STATS_LEN
+                self.shared[offset] += stats[0]
+                self.shared[offset + 1] += stats[1]
+                self.shared[offset + 2] = max(self.shared[offset + 2], stats[2])
+
+    def start(self):
+        """
+        Starts cProfile and tracemalloc captures for the current process, if enabled.
+        Captures inherited from a parent process are discarded.
+        """
+        if self.CPROFILE in self.modes:
+            import cProfile
+            if self._cprofile is not None:
+                self._cprofile.disable()
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if self.TRACEMALLOC in self.modes:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                tracemalloc.clear_traces()
+            else:
+                tracemalloc.start()
+
+    def stop(self, tag: str):
+        """
+        Stops the captures of the current process and writes them to output_dir, using tag to
+        tell apart the files of each process
+        """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._output_path(f'{tag}.prof'))
+            self._cprofile = None
+        if self.TRACEMALLOC in self.modes:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                with open(self._output_path(f'{tag}.tracemalloc.txt'), 'w') as file:
+                    file.write(f'current: {current} | peak: {peak}\n')
+                    for stat in snapshot.statistics('lineno')[:25]:
+                        file.write(f'{stat}\n')
+
+    def report(self):
+        """
+        Logs the stats of every stage and writes them to output_dir
+        """
+        if self.TIMERS not in self.modes:
+            return
+        stats = {stage: list(values) for stage, values in self.stats.items()}
+        if self.shared is not None:
+            with self.shared.get_lock():
+                for idx, stage in enumerate(self.shared_stages):
+                    offset = idx * self.STATS_LEN
+                    count, total, longest = self.shared[offset:offset + self.STATS_LEN]
+                    if count:
+                        stats[stage] = [int(count), total, longest]
+        lines = []
+        for stage, (count, total, longest) in stats.items():
+            mean = total / count if count else 0.0
+            lines.append(f'action: profiling | name: {self.name} | stage: {stage} | count: {count} | '
+                         f'total_s: {total:.6f} | mean_ms: {mean * 1000:.3f} | max_ms: {longest * 1000:.3f}')
+        for line in lines:
+            logging.info(line)
+        with open(self._output_path('summary.txt'), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def __getstate__(self):
+        # an active cProfile capture belongs to the current process and can't be pickled
+        state = self.__dict__.copy()
+        state['_cprofile'] = None
+        return state
+
+    def _output_path(self, suffix):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f'{self.name}-{suffix}')
@@ -1 +1 @@
-from .serde import AckPayload, BetPayload, FinPayload, QueryPayload, WinnerPayload, Message
\ No newline at end of file
+from .serde import AckPayload, BetPayload, FinPayload, QueryPayload, WinnerPayload, RetryPayload, Message
\ No newline at end of file
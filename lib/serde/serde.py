@@ -9,6 +9,7 @@ class Message:
     MSG_FIN = 2
     MSG_QUERY = 3
     MSG_WINNER = 4
+    MSG_RETRY = 5
 
     def __init__(self, msg_kind: int, data: list):
         self.kind = msg_kind
@@ -34,13 +35,15 @@ class Message:
             msg_class = QueryPayload
         elif msg_kind == Message.MSG_WINNER:
             msg_class = WinnerPayload
+        elif msg_kind == Message.MSG_RETRY:
+            msg_class = RetryPayload
         else:
             raise ValueError('Unsupported message type')
         offset = 1
         items = []
         while offset < len(stream):
-            item_size = uint32_from_be(stream[offset:offset+4])
-            offset += 4
+            item_size = stream[offset]
+            offset += 1
             deserialized = msg_class.deserialize(stream[offset:offset+item_size])
             items.append(deserialized)
             offset += item_size
@@ -55,7 +58,11 @@ class Message:
 class BetPayload:
     """
     A kind of Message used by agencies to notify the server of a new bet
+    The payload keeps the bytes it was built from and only decodes its fields when they are accessed,
+    so bets that are just forwarded or stored as received are never fully materialized.
     """
+    FIELDS = ('agency', 'first_name', 'last_name', 'document', 'birthdate', 'number')
+
     def __init__(self, agency: int, first_name: str, last_name: str, document: str, birthdate: str, number: str):
         data = {
             'agency': agency,
@@ -65,20 +72,35 @@ class BetPayload:
             'birthdate': birthdate,
             'number': number
         }
-        self.data = data
+        self._data = data
+        self._raw = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            values = self._raw.decode('utf-8').split(',')
+            if len(values) != len(self.FIELDS):
+                raise ValueError(f'Bet payload has {len(values)} fields, expected {len(self.FIELDS)}')
+            self._data = dict(zip(self.FIELDS, values))
+        return self._data
 
     def serialize(self):
-        string = f"{self.data['agency']},{self.data['first_name']},{self.data['last_name']},{self.data['document']},{self.data['birthdate']},{self.data['number']}"
-        return string.encode('utf-8')
+        if self._raw is None:
+            string = f"{self.data['agency']},{self.data['first_name']},{self.data['last_name']},{self.data['document']},{self.data['birthdate']},{self.data['number']}"
+            self._raw = string.encode('utf-8')
+        return self._raw
 
     @classmethod
     def deserialize(cls, msg: bytes, agency=None):
+        payload = cls.__new__(cls)
+        payload._data = None
         if agency:
             # agency passed as argument when reading from csv
-            return cls(agency, *msg.decode('utf-8').split(','))
+            payload._raw = str(agency).encode('utf-8') + b',' + msg
         else:
             # when not reading from csv, agency is sent as part of the message
-            return cls(*msg.decode('utf-8').split(','))
+            payload._raw = msg
+        return payload
 
 
 class AckPayload:
@@ -156,3 +178,23 @@ class WinnerPayload:
     @classmethod
     def deserialize(cls, msg: bytes):
         return cls(msg.decode('utf-8'))
+
+
+class RetryPayload:
+    """
+    A kind of Message used by the server to tell an agency that a batch was not stored because the server
+    is overloaded, and that it should be sent again after retry_after_ms milliseconds
+    """
+    def __init__(self, retry_after_ms: str):
+        data = {
+            'retry_after_ms': retry_after_ms
+        }
+        self.data = data
+
+    def serialize(self):
+        string = str(self.data['retry_after_ms'])
+        return string.encode('utf-8')
+
+    @classmethod
+    def deserialize(cls, msg: bytes):
+        return cls(msg.decode('utf-8'))
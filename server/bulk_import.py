@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import argparse
+from common.bulk import bulk_import
+from common.utils import LOG_FORMAT, LOG_DATEFMT
+
+
+def parse_args():
+    """
+    Parse command line arguments
+
+    Agency files can be passed as csv files named agency-<id>.csv, or as zip files containing them.
+    """
+    parser = argparse.ArgumentParser(description='Load agency bet files into the bets file without going through the network.')
+    parser.add_argument('paths', nargs='+', help='agency csv files or zip files containing them')
+    parser.add_argument('--agency', type=int, help='agency of every file, instead of reading it from the file names')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='amount of parsing processes')
+    parser.add_argument('--chunk-size', type=int, default=1 << 20, help='bytes of an agency file parsed at a time')
+    parser.add_argument('--logging-level', default=os.getenv('LOGGING_LEVEL', 'INFO'))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format=LOG_FORMAT, level=args.logging_level, datefmt=LOG_DATEFMT)
+    logging.debug(f"action: config | result: success | paths: {args.paths} | agency: {args.agency} | "
+                  f"workers: {args.workers} | chunk_size: {args.chunk_size}")
+    bulk_import(args.paths, args.workers, args.chunk_size, args.agency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import time
+import random
+import multiprocessing as mp
+
+
+class AdmissionControl:
+    """
+    Limits the bet batches being stored at the same time by all handler processes.
+
+    A batch is admitted while the batches and bytes in flight are below max_batches and max_bytes,
+    and while its agency holds less than its fair share of max_batches. A batch is always admitted
+    when nothing is in flight. Rejected batches should be answered with a RetryPayload of
+    retry_after_ms(agency).
+
+    Agencies rejected for lack of capacity are queued, and slots freed afterwards are reserved for
+    them, oldest first: other agencies are only admitted while there are more free slots than agencies
+    waiting before them. Since agencies send one batch at a time, this is what keeps an agency that
+    keeps getting rejected from being starved by the ones that happen to retry first. Retry delays
+    grow with the position in the queue and the measured time to store a batch, and a reservation
+    lapses if its agency doesn't retry within about one retry delay of the requested time.
+
+    The agency share only limits clients that keep several batches in flight, clients that wait for
+    each ACK never hold more than one slot. Admission is decided once the whole batch was received,
+    so rejected batches are transferred again when retried. Counters live in shared memory, the
+    object must be created before starting the handlers and with the same multiprocessing context.
+    """
+    # weight of the last batch in the moving average of the time to store a batch
+    SMOOTHING = 0.2
+
+    def __init__(self, agency_count: int, max_batches: int, max_bytes: int, retry_after_ms: int, ctx=mp):
+        self.max_batches = max_batches
+        self.max_bytes = max_bytes
+        # delay requested before any batch was stored, and upper bound of every delay
+        self.max_retry_after_ms = retry_after_ms
+        self.agency_share = max(1, max_batches // agency_count)
+        self.lock = ctx.Lock()
+        self.batches = ctx.RawValue('i', 0)
+        self.bytes = ctx.RawValue('q', 0)
+        # moving average of the seconds a batch stays admitted, 0 until a batch is released
+        self.store_time = ctx.RawValue('d', 0)
+        self.agency_batches = ctx.RawArray('i', agency_count)
+        # monotonic time of the first rejection of each waiting agency, 0 if not waiting
+        self.waiting_since = ctx.RawArray('d', agency_count)
+        # monotonic time until which the slot of each waiting agency stays reserved
+        self.reserved_until = ctx.RawArray('d', agency_count)
+
+    def try_admit(self, agency: int, size: int) -> bool:
+        """
+        Reserve a slot for a batch of the given agency and size, returns whether it was admitted.
+        Admitted batches must be released once stored.
+        """
+        idx = self._agency_index(agency)
+        now = time.monotonic()
+        with self.lock:
+            idle = self.batches.value == 0
+            if not idle and self.agency_batches[idx] >= self.agency_share:
+                # over its own share, this doesn't entitle the agency to a reserved slot
+                return False
+            reserved = self._waiting_before(idx, now)
+            if not idle and (self.batches.value + reserved >= self.max_batches
+                             or self.bytes.value + size > self.max_bytes):
+                if not self.waiting_since[idx]:
+                    self.waiting_since[idx] = now
+                # kept until retry_after_ms tells how long the agency will wait
+                self.reserved_until[idx] = now + 2 * self.max_retry_after_ms / 1000
+                return False
+            self.waiting_since[idx] = 0
+            self.batches.value += 1
+            self.bytes.value += size
+            self.agency_batches[idx] += 1
+            return True
+
+    def release(self, agency: int, size: int, elapsed: float):
+        """
+        Free the slot of an admitted batch, that stayed admitted for elapsed seconds
+        """
+        idx = self._agency_index(agency)
+        with self.lock:
+            self.batches.value -= 1
+            self.bytes.value -= size
+            self.agency_batches[idx] -= 1
+            if self.store_time.value:
+                self.store_time.value = self.SMOOTHING * elapsed + (1 - self.SMOOTHING) * self.store_time.value
+            else:
+                self.store_time.value = elapsed
+
+    def retry_after_ms(self, agency: int) -> int:
+        """
+        Delay to request from a rejected agency: enough to store a batch for every max_batches agencies
+        waiting before it, randomized so agencies don't retry all at once.
+        The slot of a waiting agency is reserved until one delay after the one requested.
+        """
+        idx = self._agency_index(agency)
+        now = time.monotonic()
+        with self.lock:
+            rounds = self._waiting_before(idx, now) // self.max_batches + 1
+            if self.store_time.value:
+                delay_ms = rounds * self.store_time.value * 1000 * random.uniform(1, 1.5)
+            else:
+                delay_ms = self.max_retry_after_ms * random.uniform(0.5, 1)
+            delay_ms = max(1, min(self.max_retry_after_ms, int(delay_ms)))
+            if self.waiting_since[idx]:
+                self.reserved_until[idx] = now + 2 * delay_ms / 1000
+            return delay_ms
+
+    def _waiting_before(self, idx: int, now: float) -> int:
+        """
+        Amount of agencies that have been waiting longer than the given one, which waits for no one if
+        it isn't waiting itself. Agencies that didn't retry in time lose their place.
+        """
+        own_since = self.waiting_since[idx] or now
+        waiting = 0
+        for other, since in enumerate(self.waiting_since):
+            if not since or other == idx:
+                continue
+            if now > self.reserved_until[other]:
+                self.waiting_since[other] = 0
+            elif since <= own_since:
+                waiting += 1
+        return waiting
+
+    def _agency_index(self, agency: int) -> int:
+        # agencies are numbered from 1 to agency_count, any other id shares a counter with one of them
+        return (agency - 1) % len(self.agency_batches)
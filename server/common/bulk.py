@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import logging
+import zipfile
+import multiprocessing as mp
+from .utils import Bet, format_bet, raw_bet_ack_fields, store_raw_bets
+
+""" Name of the bet files of each agency, as found in the dataset. """
+AGENCY_FILENAME = re.compile(r'agency-(\d+)\.csv$')
+
+
+def parse_agency_chunk(task):
+    """
+    Convert a chunk of complete lines of an agency file into rows of the bets file.
+    Lines are stored as is when possible, the rest are parsed into Bet and formatted like store_bets.
+    Returns the name of the chunk source, the rows, in the same order as the lines, and the amount of
+    invalid lines that were skipped.
+    """
+    name, agency, chunk = task
+    prefix = str(agency).encode('utf-8') + b','
+    rows = []
+    rejected = 0
+    for line in chunk.split(b'\n'):
+        line = line.rstrip()
+        if not line:
+            continue
+        raw = prefix + line
+        if raw_bet_ack_fields(raw) is None:
+            try:
+                raw = format_bet(Bet(agency, *line.decode('utf-8').split(',')))
+            except (TypeError, ValueError):
+                rejected += 1
+                continue
+        rows.append(raw)
+    return name, rows, rejected
+
+
+def read_chunks(file, chunk_size: int):
+    """
+    Read a bets file in chunks of about chunk_size bytes that only contain complete lines
+    """
+    leftover = b''
+    while (data := file.read(chunk_size)):
+        data = leftover + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            # no complete line yet, keep reading
+            leftover = data
+            continue
+        leftover = data[end:]
+        yield data[:end]
+    if leftover:
+        yield leftover
+
+
+def agency_from_filename(filename: str) -> int:
+    match = AGENCY_FILENAME.search(filename)
+    if not match:
+        raise ValueError(f'Can not tell the agency of {filename}, expected a name like agency-<id>.csv')
+    return int(match.group(1))
+
+
+def find_sources(paths: list[str], agency=None) -> list[tuple[str, str, str, int]]:
+    """
+    Return (name, path, member, agency) for each agency file in paths, member being the name of the
+    file inside a zip file or None. Every path is checked before anything is imported, so an invalid
+    one fails the whole import instead of leaving it halfway.
+    If agency is given it is used for every file instead of reading it from the file names.
+    """
+    sources = []
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'Agency file {path} does not exist')
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                members = [member for member in archive.namelist() if AGENCY_FILENAME.search(member)]
+            if not members:
+                raise ValueError(f'{path} does not contain any file named like agency-<id>.csv')
+            for member in members:
+                sources.append((f'{path}:{member}', path, member, agency or agency_from_filename(member)))
+        else:
+            sources.append((path, path, None, agency or agency_from_filename(path)))
+    return sources
+
+
+def open_sources(sources: list[tuple[str, str, str, int]]):
+    """
+    Yield (name, agency, file) for each agency file returned by find_sources
+    """
+    for name, path, member, agency in sources:
+        if member is None:
+            with open(path, 'rb') as file:
+                yield name, agency, file
+        else:
+            with zipfile.ZipFile(path) as archive, archive.open(member) as file:
+                yield name, agency, file
+
+
+def bulk_import(paths: list[str], workers: int, chunk_size: int, agency=None) -> int:
+    """
+    Load the bets of every agency file in paths into the bets file, parsing them in parallel with
+    the given amount of worker processes. Chunks are stored in the order they were read.
+    Must not run while a server is storing bets in the same file.
+    Returns the amount of bets stored.
+    """
+    start = time.monotonic()
+    files = find_sources(paths, agency)
+    sources = {}
+    total_bets = 0
+    total_rejected = 0
+
+    def tasks():
+        # chunks of every file are queued back to back so workers don't wait between files
+        for name, file_agency, file in open_sources(files):
+            sources[name] = 0
+            for chunk in read_chunks(file, chunk_size):
+                yield name, file_agency, chunk
+
+    with mp.Pool(workers) as pool:
+        for name, rows, rejected in pool.imap(parse_agency_chunk, tasks()):
+            store_raw_bets(rows)
+            sources[name] += len(rows)
+            total_bets += len(rows)
+            total_rejected += rejected
+            logging.info(f'action: bulk_import | result: in_progress | file: {name} | bets: {sources[name]} | '
+                         f'total_bets: {total_bets} | elapsed_s: {time.monotonic() - start:.2f}')
+    elapsed = time.monotonic() - start
+    if total_rejected:
+        logging.warning(f'action: bulk_import | result: fail | rejected_bets: {total_rejected}')
+    logging.info(f'action: bulk_import | result: success | files: {len(sources)} | bets: {total_bets} | '
+                 f'elapsed_s: {elapsed:.2f} | bets_per_second: {total_bets / max(elapsed, 1e-6):.0f}')
+    return total_bets
@@ -1,25 +1,51 @@
+import os
+import time
 import signal
 import logging
 import multiprocessing as mp
+from contextlib import nullcontext
 from lib.network import MINTSocket
-from lib.serde import Message, AckPayload, WinnerPayload
-from .utils import Bet, store_bets, load_bets, has_won
+from lib.serde import Message, AckPayload, WinnerPayload, RetryPayload
+from .admission import AdmissionControl
+from .utils import Bet, store_bets, store_raw_bets, raw_bet_ack_fields, load_winner_documents
 
 def signal_handler(signalnum, stack_frame):
     raise StopIteration
 
 
+""" Stages timed by handler processes, accumulated in shared memory by the profiler. """
+HANDLER_STAGES = ('recv', 'deserialize', 'store', 'ack', 'query')
+
+
+def profiler_stage(profiler, name: str):
+    """
+    Times a stage with the given profiler, which is None when profiling is disabled
+    """
+    return profiler.stage(name) if profiler else nullcontext()
+
+
 class Server:
-    def __init__(self, port, listen_backlog, agency_count):
+    def __init__(self, port, listen_backlog, agency_count, max_handlers, max_inflight_batches, max_inflight_bytes,
+                 retry_after_ms, profiler):
+        # Handlers are forked so they start with every module of the server already imported, and
+        # synchronization primitives must be created with the context used to start them
+        self.mp = mp.get_context('fork')
         # Initialize server socket
         self.server_socket = MINTSocket()
         self.server_socket.bind(('', port))
         self.server_socket.listen(listen_backlog)
-        self.betsfile_lock = mp.Lock()
+        self.betsfile_lock = self.mp.Lock()
         # Use a semaphore to track the amount of agencies that are ready for the lottery
-        self.agency_tracker = mp.Semaphore(agency_count - 1)
+        self.agency_tracker = self.mp.Semaphore(agency_count - 1)
         # Use an event to notify all agencies when the lottery takes place
-        self.lottery_ready = mp.Event()
+        self.lottery_ready = self.mp.Event()
+        # Each agency may have a handler blocked waiting for the lottery, those don't count towards max_handlers
+        self.max_handlers = max_handlers + agency_count
+        self.admission = AdmissionControl(agency_count, max_inflight_batches, max_inflight_bytes, retry_after_ms, self.mp)
+        # None unless profiling is enabled
+        self.profiler = profiler
+        if self.profiler:
+            self.profiler.share(HANDLER_STAGES, self.mp)
 
     def run(self):
         """
@@ -28,14 +54,22 @@ class Server:
         Server that accept a new connections and establishes a
         communication with a client. The established connection is dispatched
         for a new process to handle the messages.
+        New connections are not accepted while max_handlers processes are running,
+        they wait in the listen backlog instead.
         """
         signal.signal(signal.SIGTERM, signal_handler)
+        if self.profiler:
+            self.profiler.start()
         try:
             # UNBLOCK signals now that exceptions can be caught and handled
             signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
             while True:
+                self.wait_for_handler_slot()
                 client_sock = self.accept_new_connection()
-                dispatch_connection(client_sock, self.agency_tracker, self.lottery_ready, self.betsfile_lock)
+                # accept blocks until a client connects, only the work done for each connection is timed
+                with profiler_stage(self.profiler, 'dispatch'):
+                    dispatch_connection(self.mp, client_sock, self.agency_tracker, self.lottery_ready,
+                                        self.betsfile_lock, self.admission, self.profiler)
         except StopIteration:
             self.server_socket.close()
             logging.debug(f"action: close_server_socket | result: success")
@@ -46,6 +80,22 @@ class Server:
             for process in mp.active_children():
                 process.terminate()
                 process.join()
+            if self.profiler:
+                self.profiler.stop('main')
+                self.profiler.report()
+
+    def wait_for_handler_slot(self):
+        """
+        Block until less than max_handlers handler processes are running
+        """
+        # active_children also joins finished processes
+        handlers = mp.active_children()
+        while len(handlers) >= self.max_handlers:
+            # imported here since it is only needed under load
+            from multiprocessing.connection import wait
+            logging.debug(f'action: wait_handler_slot | result: in_progress | handlers: {len(handlers)}')
+            wait([handler.sentinel for handler in handlers])
+            handlers = mp.active_children()
 
     def accept_new_connection(self):
         """
@@ -68,12 +118,15 @@ class Server:
 
 
 class ClientHandler:
-    def __init__(self, socket: MINTSocket, agency_tracker: mp.Semaphore, lottery_ready: mp.Event, betsfile_lock: mp.Lock):
+    def __init__(self, socket: MINTSocket, agency_tracker: mp.Semaphore, lottery_ready: mp.Event, betsfile_lock: mp.Lock,
+                 admission: AdmissionControl, profiler):
         # Initialize server socket
         self.socket = socket
         self.agency_tracker = agency_tracker
         self.lottery_ready = lottery_ready
         self.betsfile_lock = betsfile_lock
+        self.admission = admission
+        self.profiler = profiler
 
     def run(self):
         """
@@ -82,11 +135,16 @@ class ClientHandler:
         If a problem arises in the communication with the client, the
         client socket will also be closed
         """
+        if self.profiler:
+            self.profiler.start()
         try:
-            msg = self.socket.recv()
+            with profiler_stage(self.profiler, 'recv'):
+                buffer = self.socket.recv_bytes()
+            with profiler_stage(self.profiler, 'deserialize'):
+                msg = Message.deserialize(buffer)
             addr = self.socket.getpeername()
             if msg.kind == Message.MSG_BET:
-                self.handle_bet_message(msg)
+                self.handle_bet_message(msg, len(buffer))
                 self.socket.close()
                 logging.debug(f"action: close_client_socket | result: success")
             elif msg.kind == Message.MSG_FIN:
@@ -101,21 +159,66 @@ class ClientHandler:
         except OSError as e:
             logging.error(f"action: receive_message | result: fail | error: {e}")
             return e
+        finally:
+            if self.profiler:
+                self.profiler.stop(f'handler-{os.getpid()}')
+                self.profiler.flush()
 
-    def handle_bet_message(self, msg):
+    def handle_bet_message(self, msg, size):
         """
         Read new bets from client, store them and notify the client once all of them have been stored
+        If the server is overloaded the batch is not stored and the client is asked to send it again later.
+        """
+        if not msg.data:
+            self.socket.send(Message(Message.MSG_ACK, []))
+            return
+        # agency is the first field of every bet, read it without decoding the whole bet
+        agency = int(msg.data[0].serialize().split(b',', 1)[0])
+        if not self.admission.try_admit(agency, size):
+            retry_after_ms = self.admission.retry_after_ms(agency)
+            logging.debug(f'action: admission | result: rejected | agency: {agency} | retry_after_ms: {retry_after_ms}')
+            self.socket.send(Message(Message.MSG_RETRY, [RetryPayload(retry_after_ms)]))
+            return
+        start = time.monotonic()
+        try:
+            acks = self.store_bet_batch(msg)
+        finally:
+            # the slot only covers storing the batch, not waiting for the client to read the ACK
+            self.admission.release(agency, size, time.monotonic() - start)
+        self.send_bet_acks(acks)
+
+    def store_bet_batch(self, msg):
+        """
+        Store a batch of bets and return the (document, number) of each of them for the ACK
+        Bets are appended to the bets file as received, only the fields needed for the ACK are decoded.
+        Batches that can't be stored as is are parsed into Bet before storing them.
+        """
+        with profiler_stage(self.profiler, 'store'):
+            raw_bets = [payload.serialize() for payload in msg.data]
+            acks = [raw_bet_ack_fields(raw) for raw in raw_bets]
+            if None in acks:
+                bets = [Bet(**payload.data) for payload in msg.data]
+                # ACK the fields as received, like the raw path does
+                acks = [(payload.data['document'], payload.data['number']) for payload in msg.data]
+                with self.betsfile_lock:
+                    store_bets(bets)
+            else:
+                with self.betsfile_lock:
+                    store_raw_bets(raw_bets)
+        return acks
+
+    def send_bet_acks(self, acks):
+        """
+        Notify the client that the bets of its batch have been stored
         """
-        bets = [Bet(**msg.data) for msg in msg.data]
-        with self.betsfile_lock:
-            store_bets(bets)
         msg = []
-        for bet in bets:
-            logging.info(f'action: apuesta_almacenada | result: success | dni: {bet.document} | numero: {bet.number}')
-            payload = AckPayload(bet.document, bet.number)
+        for document, number in acks:
+            logging.info(f'action: apuesta_almacenada | result: success | dni: {document} | numero: {number}')
+            payload = AckPayload(document, number)
             msg.append(payload)
         batch_msg = Message(Message.MSG_ACK, msg)
-        self.socket.send(batch_msg)
+        with profiler_stage(self.profiler, 'ack'):
+            self.socket.send(batch_msg)
 
     def handle_fin_message(self, _):
         """
@@ -136,7 +239,8 @@ class ClientHandler:
         """
         self.lottery_ready.wait()
         agency = int(msg.data[0].data['agency'])
-        winners = self.get_winners(agency)
+        with profiler_stage(self.profiler, 'query'):
+            winners = self.get_winners(agency)
         msg = [WinnerPayload(winner) for winner in winners]
         batch_msg = Message(Message.MSG_WINNER, msg)
         self.socket.send(batch_msg)
@@ -145,12 +249,13 @@ class ClientHandler:
 
     def get_winners(self, agency):
         with self.betsfile_lock:
-            return [bet.document for bet in load_bets() if has_won(bet) and bet.agency == agency]
+            return load_winner_documents(agency)
 
 
-def dispatch_connection(client_sock: MINTSocket, agency_tracker: mp.Semaphore, lottery_ready: mp.Event, betsfile_lock: mp.Lock):
+def dispatch_connection(ctx, client_sock: MINTSocket, agency_tracker: mp.Semaphore, lottery_ready: mp.Event, betsfile_lock: mp.Lock,
+                        admission: AdmissionControl, profiler):
     """
     Start a new process to handle a client connection.
     """
-    handler = ClientHandler(client_sock, agency_tracker, lottery_ready, betsfile_lock)
-    mp.Process(target=ClientHandler.run, args=[handler]).start()
+    handler = ClientHandler(client_sock, agency_tracker, lottery_ready, betsfile_lock, admission, profiler)
+    ctx.Process(target=ClientHandler.run, args=[handler]).start()
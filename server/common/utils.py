@@ -1,15 +1,46 @@
+from __future__ import annotations
+import io
 import csv
+import sys
 import datetime
+import functools
 
 
 """ Bets storage location. """
 STORAGE_FILEPATH = "./bets.csv"
 """ Simulated winner number in the lottery contest. """
 LOTTERY_WINNER_NUMBER = 7574
+""" Line terminator written by csv.writer, used by every row of the STORAGE_FILEPATH file. """
+STORAGE_LINE_TERMINATOR = b'\r\n'
+""" Maximum amount of distinct birthdates kept parsed in memory. """
+BIRTHDATE_CACHE_SIZE = 16384
+""" Log format shared by the server and the bulk import tool. """
+LOG_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+"""
+Parses a birthdate with format 'YYYY-MM-DD'.
+Birthdates repeat a lot across bets, so parsed dates are memoized with a bounded LRU.
+"""
+@functools.lru_cache(maxsize=BIRTHDATE_CACHE_SIZE)
+def parse_birthdate(birthdate: str) -> datetime.date:
+    return datetime.date.fromisoformat(birthdate)
+
+"""
+Returns a canonical copy of a first or last name.
+Names repeat a lot across bets, interning them makes every bet share the same string object.
+Every name is interned, since telling repeated names apart would cost more than the lookup itself.
+Unique names don't leak: interned strings are freed once no bet references them.
+"""
+def intern_name(name: str) -> str:
+    return sys.intern(name)
 
 
 """ A lottery bet registry. """
 class Bet:
+    __slots__ = ('agency', 'first_name', 'last_name', 'document', '_birthdate', 'number')
+
     def __init__(self, agency: str, first_name: str, last_name: str, document: str, birthdate: str, number: str):
         """
         agency must be passed with integer format.
@@ -17,12 +48,34 @@ class Bet:
         number must be passed with integer format.
         """
         self.agency = int(agency)
-        self.first_name = first_name
-        self.last_name = last_name
+        self.first_name = intern_name(first_name)
+        self.last_name = intern_name(last_name)
         self.document = document
-        self.birthdate = datetime.date.fromisoformat(birthdate)
+        self._birthdate = parse_birthdate(birthdate)
         self.number = int(number)
 
+    @classmethod
+    def from_stored_row(cls, row: list[str]) -> 'Bet':
+        """
+        Builds a bet from a row of the STORAGE_FILEPATH file.
+        Rows were already validated when stored, so parsing the birthdate is deferred
+        until it is accessed. Winner checks use load_winner_documents instead.
+        """
+        bet = cls.__new__(cls)
+        bet.agency = int(row[0])
+        bet.first_name = intern_name(row[1])
+        bet.last_name = intern_name(row[2])
+        bet.document = row[3]
+        bet._birthdate = row[4]
+        bet.number = int(row[5])
+        return bet
+
+    @property
+    def birthdate(self) -> datetime.date:
+        if isinstance(self._birthdate, str):
+            self._birthdate = parse_birthdate(self._birthdate)
+        return self._birthdate
+
 """ Checks whether a bet won the prize or not. """
 def has_won(bet: Bet) -> bool:
     return bet.number == LOTTERY_WINNER_NUMBER
@@ -38,6 +91,53 @@ def store_bets(bets: list[Bet]) -> None:
             writer.writerow([bet.agency, bet.first_name, bet.last_name,
                              bet.document, bet.birthdate, bet.number])
 
+"""
+Formats a bet as a row of the STORAGE_FILEPATH file, without line terminator.
+"""
+def format_bet(bet: Bet) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_MINIMAL, lineterminator='')
+    writer.writerow([bet.agency, bet.first_name, bet.last_name,
+                     bet.document, bet.birthdate, bet.number])
+    return buffer.getvalue().encode('utf-8')
+
+"""
+Checks whether a raw field is an integer written the same way store_bets writes it,
+that is without sign, spaces or leading zeros.
+"""
+def is_canonical_int(field: bytes) -> bool:
+    return field.isdigit() and (field[:1] != b'0' or field == b'0')
+
+"""
+Extracts the document and number of a bet received as a raw csv row.
+Returns None if the row can't be appended to the STORAGE_FILEPATH file as is, either because
+it is not a valid bet or because it would need quoting, in which case it must go through Bet.
+"""
+def raw_bet_ack_fields(raw: bytes) -> tuple[str, str] | None:
+    fields = raw.split(b',')
+    if len(fields) != 6 or b'"' in raw or b'\n' in raw or b'\r' in raw:
+        return None
+    agency, _, _, document, birthdate, number = fields
+    if not (is_canonical_int(agency) and is_canonical_int(number)):
+        return None
+    try:
+        raw.decode('utf-8')
+        birthdate = birthdate.decode('ascii')
+        if parse_birthdate(birthdate).isoformat() != birthdate:
+            return None
+        return document.decode('utf-8'), number.decode('ascii')
+    except ValueError:
+        return None
+
+"""
+Persist bets received as raw csv rows in the STORAGE_FILEPATH file, with the same format as store_bets.
+Rows must have been checked with raw_bet_ack_fields.
+Not thread-safe/process-safe.
+"""
+def store_raw_bets(raw_bets: list[bytes]) -> None:
+    with open(STORAGE_FILEPATH, 'ab') as file:
+        file.write(b''.join(raw + STORAGE_LINE_TERMINATOR for raw in raw_bets))
+
 """
 Loads the information all the bets in the STORAGE_FILEPATH file.
 Not thread-safe/process-safe.
@@ -46,5 +146,31 @@ def load_bets() -> list[Bet]:
     with open(STORAGE_FILEPATH, 'r') as file:
         reader = csv.reader(file, quoting=csv.QUOTE_MINIMAL)
         for row in reader:
-            yield Bet(row[0], row[1], row[2], row[3], row[4], row[5])
+            yield Bet.from_stored_row(row)
+
 
+"""
+Loads the documents of the bets of an agency that won the prize.
+Agency and number are the first and last fields of every row and are never quoted, so rows are only
+parsed with csv when their number is the winner one. Quoted fields spanning several lines are joined
+before checking them.
+Not thread-safe/process-safe.
+"""
+def load_winner_documents(agency: int) -> list[str]:
+    winner_suffix = f',{LOTTERY_WINNER_NUMBER}'
+    documents = []
+    pending = ''
+    with open(STORAGE_FILEPATH, 'r', newline='') as file:
+        for line in file:
+            if pending or line.count('"') % 2:
+                # a quoted field continues in the next line
+                pending += line
+                if pending.count('"') % 2:
+                    continue
+                line, pending = pending, ''
+            if not line.rstrip('\r\n').endswith(winner_suffix):
+                continue
+            bet = Bet.from_stored_row(next(csv.reader([line], quoting=csv.QUOTE_MINIMAL)))
+            if has_won(bet) and bet.agency == agency:
+                documents.append(bet.document)
+    return documents
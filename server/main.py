@@ -4,6 +4,7 @@ import os
 import signal
 import logging
 from common.server import Server
+from common.utils import LOG_FORMAT, LOG_DATEFMT
 from configparser import ConfigParser
 
 
@@ -28,6 +29,16 @@ def initialize_config():
         config_params["listen_backlog"] = int(os.getenv('SERVER_LISTEN_BACKLOG', config["DEFAULT"]["SERVER_LISTEN_BACKLOG"]))
         config_params["logging_level"] = os.getenv('LOGGING_LEVEL', config["DEFAULT"]["LOGGING_LEVEL"])
         config_params["agency_count"] = int(os.getenv('SERVER_AGENCY_COUNT', config["DEFAULT"]["AGENCY_COUNT"]))
+        config_params["max_handlers"] = int(os.getenv('SERVER_MAX_HANDLERS', config["DEFAULT"]["MAX_HANDLERS"]))
+        config_params["max_inflight_batches"] = int(os.getenv('SERVER_MAX_INFLIGHT_BATCHES', config["DEFAULT"]["MAX_INFLIGHT_BATCHES"]))
+        config_params["max_inflight_bytes"] = int(os.getenv('SERVER_MAX_INFLIGHT_BYTES', config["DEFAULT"]["MAX_INFLIGHT_BYTES"]))
+        config_params["retry_after_ms"] = int(os.getenv('SERVER_RETRY_AFTER_MS', config["DEFAULT"]["RETRY_AFTER_MS"]))
+        config_params["profiling"] = os.getenv('SERVER_PROFILING', config["DEFAULT"]["PROFILING"]).strip()
+        if config_params["profiling"]:
+            # only import the profiler when it is going to be used, to keep the server startup short
+            from lib.profiling import Profiler
+            config_params["profiling"] = Profiler.parse_modes(config_params["profiling"])
+        config_params["profiling_dir"] = os.getenv('SERVER_PROFILING_DIR', config["DEFAULT"]["PROFILING_DIR"])
     except KeyError as e:
         raise KeyError("Key was not found. Error: {} .Aborting server".format(e))
     except ValueError as e:
@@ -42,13 +53,22 @@ def main():
     port = config_params["port"]
     listen_backlog = config_params["listen_backlog"]
     agency_count = config_params["agency_count"]
+    max_handlers = config_params["max_handlers"]
+    max_inflight_batches = config_params["max_inflight_batches"]
+    max_inflight_bytes = config_params["max_inflight_bytes"]
+    retry_after_ms = config_params["retry_after_ms"]
+    profiling = config_params["profiling"]
+    profiling_dir = config_params["profiling_dir"]
 
     initialize_log(logging_level)
 
     # Log config parameters at the beginning of the program to verify the configuration
     # of the component
     logging.debug(f"action: config | result: success | port: {port} | "
-                  f"listen_backlog: {listen_backlog} | logging_level: {logging_level} | agency_count: {agency_count}")
+                  f"listen_backlog: {listen_backlog} | logging_level: {logging_level} | agency_count: {agency_count}"
+                  f" | max_handlers: {max_handlers} | max_inflight_batches: {max_inflight_batches}"
+                  f" | max_inflight_bytes: {max_inflight_bytes} | retry_after_ms: {retry_after_ms}"
+                  f" | profiling: {profiling} | profiling_dir: {profiling_dir}")
 
 
     # BLOCK SIGTERM signals to process them later.
@@ -57,7 +77,12 @@ def main():
     # have to be allocated before the block
     signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
     # Initialize server and start server loop
-    server = Server(port, listen_backlog, agency_count)
+    profiler = None
+    if profiling:
+        from lib.profiling import Profiler
+        profiler = Profiler('server', profiling, profiling_dir)
+    server = Server(port, listen_backlog, agency_count, max_handlers, max_inflight_batches, max_inflight_bytes,
+                    retry_after_ms, profiler)
     server.run()
 
 def initialize_log(logging_level):
@@ -68,9 +93,9 @@ def initialize_log(logging_level):
     compose logs the date when the log has arrived
     """
     logging.basicConfig(
-        format='%(asctime)s %(levelname)-8s %(message)s',
+        format=LOG_FORMAT,
         level=logging_level,
-        datefmt='%Y-%m-%d %H:%M:%S',
+        datefmt=LOG_DATEFMT,
     )
 
 
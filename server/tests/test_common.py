@@ -1,6 +1,16 @@
 from common.utils import *
+from common.admission import AdmissionControl
+from common.server import ClientHandler
+from lib.serde import Message, BetPayload
+from lib.profiling import Profiler
+from common.bulk import bulk_import, parse_agency_chunk, read_chunks
+import io
 import os
+import multiprocessing as mp
+import tempfile
 import unittest
+import zipfile
+from unittest import mock
 
 class TestUtils(unittest.TestCase):
 
@@ -46,6 +56,59 @@ class TestUtils(unittest.TestCase):
         self._assert_equal_bets(to_store[0], from_load[0])
         self._assert_equal_bets(to_store[1], from_load[1])
 
+    def test_bet_init_must_share_repeated_names(self):
+        b1 = Bet('1', ''.join(['fir', 'st']), 'last', '10000000','2000-12-20', 7500)
+        b2 = Bet('2', ''.join(['fi', 'rst']), 'last', '10000001','2000-12-20', 7501)
+        self.assertIs(b1.first_name, b2.first_name)
+        self.assertIs(b1.birthdate, b2.birthdate)
+
+    def test_load_bets_defers_birthdate_parsing_until_accessed(self):
+        store_bets([Bet('1', 'first', 'last', '10000000','2000-12-20', 7500)])
+        with mock.patch('common.utils.parse_birthdate', wraps=parse_birthdate) as parse:
+            bet = next(load_bets())
+            parse.assert_not_called()
+            self.assertEqual(datetime.date(2000, 12, 20), bet.birthdate)
+            parse.assert_called_once_with('2000-12-20')
+
+    def test_load_winner_documents_matches_load_bets(self):
+        store_bets([
+            Bet('1', 'first', 'last', '10000000','2000-12-20', LOTTERY_WINNER_NUMBER),
+            Bet('2', 'first', 'last', '10000001','2000-12-20', LOTTERY_WINNER_NUMBER),
+            Bet('1', 'fi,rst', 'la"st', '10000002','2000-12-20', LOTTERY_WINNER_NUMBER),
+            Bet('1', 'first\n,7574', 'last', '10000003','2000-12-20', 7500),
+            Bet('1', 'first', 'last\nname', '10000004','2000-12-20', LOTTERY_WINNER_NUMBER),
+            Bet('1', 'first', 'last', '10000005','2000-12-20', 17574),
+        ])
+        for agency in (1, 2):
+            expected = [bet.document for bet in load_bets() if has_won(bet) and bet.agency == agency]
+            self.assertEqual(expected, load_winner_documents(agency))
+        self.assertEqual(['10000000', '10000002', '10000004'], load_winner_documents(1))
+
+    def test_store_raw_bets_and_load_bets_keeps_fields_data(self):
+        raw = b'1,first,last,10000000,2000-12-20,7500'
+        self.assertEqual(('10000000', '7500'), raw_bet_ack_fields(raw))
+        store_raw_bets([raw])
+        from_load = list(load_bets())
+
+        self.assertEqual(1, len(from_load))
+        self._assert_equal_bets(Bet('1', 'first', 'last', '10000000','2000-12-20', 7500), from_load[0])
+
+    def test_raw_bet_ack_fields_rejects_rows_that_cant_be_stored_as_is(self):
+        self.assertIsNone(raw_bet_ack_fields(b'1,first,last,10000000,2000-12-20'))
+        self.assertIsNone(raw_bet_ack_fields(b'1,"first",last,10000000,2000-12-20,7500'))
+        self.assertIsNone(raw_bet_ack_fields(b'1,first,last,10000000,2000-13-20,7500'))
+        self.assertIsNone(raw_bet_ack_fields(b'1,first,last,10000000,2000-12-20,seven'))
+
+    def test_raw_bet_ack_fields_rejects_non_canonical_integers(self):
+        self.assertIsNone(raw_bet_ack_fields(b'1,first,last,10000000,2000-12-20,0001'))
+        self.assertIsNone(raw_bet_ack_fields(b'01,first,last,10000000,2000-12-20,1'))
+        self.assertEqual(('10000000', '0'), raw_bet_ack_fields(b'1,first,last,10000000,2000-12-20,0'))
+
+    def test_non_canonical_integers_are_stored_like_store_bets(self):
+        store_bets([Bet('01', 'first', 'last', '10000000','2000-12-20', '0001')])
+        with open(STORAGE_FILEPATH, 'rb') as file:
+            self.assertEqual(b'1,first,last,10000000,2000-12-20,1\r\n', file.read())
+
     def _assert_equal_bets(self, b1, b2):
         self.assertEqual(b1.agency, b2.agency)
         self.assertEqual(b1.first_name, b2.first_name)
@@ -54,6 +117,160 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(b1.birthdate, b2.birthdate)
         self.assertEqual(b1.number, b2.number)
 
+
+class TestAdmissionControl(unittest.TestCase):
+
+    def test_try_admit_rejects_batches_over_agency_share(self):
+        admission = AdmissionControl(2, 2, 1000, 100)
+        self.assertTrue(admission.try_admit(1, 10))
+        self.assertFalse(admission.try_admit(1, 10))
+        self.assertTrue(admission.try_admit(2, 10))
+
+    def test_try_admit_rejects_batches_over_max_bytes_unless_idle(self):
+        admission = AdmissionControl(2, 2, 100, 100)
+        self.assertTrue(admission.try_admit(1, 200))
+        self.assertFalse(admission.try_admit(2, 10))
+        admission.release(1, 200, 0.001)
+        self.assertTrue(admission.try_admit(2, 10))
+
+    def test_try_admit_reserves_freed_slots_for_waiting_agencies(self):
+        admission = AdmissionControl(3, 2, 1000, 100)
+        self.assertTrue(admission.try_admit(1, 10))
+        self.assertTrue(admission.try_admit(3, 10))
+        self.assertFalse(admission.try_admit(2, 10))
+        admission.retry_after_ms(2)
+        admission.release(1, 10, 0.001)
+        # agency 1 retries first, but agency 2 has been waiting for the slot
+        self.assertFalse(admission.try_admit(1, 10))
+        self.assertTrue(admission.try_admit(2, 10))
+
+    def test_try_admit_never_rejects_when_nothing_is_in_flight(self):
+        admission = AdmissionControl(2, 1, 1000, 100)
+        self.assertTrue(admission.try_admit(1, 10))
+        self.assertFalse(admission.try_admit(2, 10))
+        admission.retry_after_ms(2)
+        admission.release(1, 10, 0.001)
+        # the slot is reserved for agency 2, but leaving it idle while agency 2 sleeps would waste it
+        self.assertTrue(admission.try_admit(1, 10))
+
+    def test_reservations_lapse_if_agencies_dont_retry_in_time(self):
+        admission = AdmissionControl(3, 2, 1000, 100)
+        with mock.patch('common.admission.time.monotonic', return_value=10.0):
+            self.assertTrue(admission.try_admit(1, 10))
+            self.assertTrue(admission.try_admit(3, 10))
+            self.assertFalse(admission.try_admit(2, 10))
+            retry_after_ms = admission.retry_after_ms(2)
+            admission.release(1, 10, 0.001)
+        with mock.patch('common.admission.time.monotonic', return_value=10.0 + 3 * retry_after_ms / 1000):
+            self.assertTrue(admission.try_admit(1, 10))
+
+    def test_retry_after_ms_grows_with_queue_position_and_store_time(self):
+        admission = AdmissionControl(4, 1, 1000, 1000)
+        self.assertTrue(admission.try_admit(1, 10))
+        admission.release(1, 10, 0.01)
+        self.assertTrue(admission.try_admit(1, 10))
+        self.assertFalse(admission.try_admit(2, 10))
+        self.assertFalse(admission.try_admit(3, 10))
+        self.assertFalse(admission.try_admit(4, 10))
+        for position, agency in enumerate((2, 3, 4)):
+            retry_after_ms = admission.retry_after_ms(agency)
+            self.assertGreaterEqual(retry_after_ms, 10 * (position + 1))
+            self.assertLessEqual(retry_after_ms, 15 * (position + 1))
+
+class TestClientHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = mock.Mock()
+        self.admission = AdmissionControl(2, 1, 1000, 100)
+        self.handler = ClientHandler(self.socket, None, None, mp.Lock(), self.admission, Profiler('test'))
+        self.batch = Message.deserialize(Message(Message.MSG_BET, [
+            BetPayload(2, 'first', 'last', '10000000', '2000-12-20', '7500'),
+        ]).serialize())
+
+    def tearDown(self):
+        if os.path.exists(STORAGE_FILEPATH):
+            os.remove(STORAGE_FILEPATH)
+
+    def sent_message(self):
+        return Message.deserialize(self.socket.send.call_args.args[0].serialize())
+
+    def test_overloaded_server_asks_to_retry_without_storing(self):
+        self.assertTrue(self.admission.try_admit(1, 10))
+        self.handler.handle_bet_message(self.batch, 100)
+        msg = self.sent_message()
+        self.assertEqual(Message.MSG_RETRY, msg.kind)
+        self.assertLessEqual(1, int(msg.data[0].data['retry_after_ms']))
+        self.assertFalse(os.path.exists(STORAGE_FILEPATH))
+
+        self.admission.release(1, 10, 0.001)
+        self.handler.handle_bet_message(self.batch, 100)
+        msg = self.sent_message()
+        self.assertEqual(Message.MSG_ACK, msg.kind)
+        self.assertEqual({'document': '10000000', 'number': '7500'}, msg.data[0].data)
+        self.assertEqual(1, len(list(load_bets())))
+        self.assertEqual(0, self.admission.batches.value)
+
+    def test_empty_batch_is_acknowledged_without_admission(self):
+        self.assertTrue(self.admission.try_admit(1, 10))
+        self.handler.handle_bet_message(Message(Message.MSG_BET, []), 2)
+        msg = self.sent_message()
+        self.assertEqual(Message.MSG_ACK, msg.kind)
+        self.assertEqual([], msg.data)
+
+class TestBulkImport(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(STORAGE_FILEPATH):
+            os.remove(STORAGE_FILEPATH)
+
+    def test_read_chunks_only_yields_complete_lines(self):
+        file = io.BytesIO(b'first line\r\nsecond line\r\nthird')
+        self.assertEqual([b'first line\r\n', b'second line\r\n', b'third'], list(read_chunks(file, 8)))
+
+    def test_parse_agency_chunk_keeps_format_of_store_bets(self):
+        chunk = b'first,last,10000000,2000-12-20,7500\r\n"fi,rst,last,1,2000-12-20,1\r\nfi"rst,last,10000001,2000-12-21,7501\r\n'
+        name, rows, rejected = parse_agency_chunk(('agency-1.csv', 1, chunk))
+        self.assertEqual('agency-1.csv', name)
+        self.assertEqual(1, rejected)
+        store_raw_bets(rows)
+        with open(STORAGE_FILEPATH, 'rb') as file:
+            bulk_stored = file.read()
+        os.remove(STORAGE_FILEPATH)
+        store_bets([
+            Bet('1', 'first', 'last', '10000000','2000-12-20', 7500),
+            Bet('1', 'fi"rst', 'last', '10000001','2000-12-21', 7501),
+        ])
+        with open(STORAGE_FILEPATH, 'rb') as file:
+            self.assertEqual(file.read(), bulk_stored)
+
+    def test_bulk_import_stores_every_agency_file_of_a_zip_in_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'dataset.zip')
+            with zipfile.ZipFile(path, 'w') as archive:
+                archive.writestr('agency-1.csv', ''.join(f'first,last,1000000{i},2000-12-20,{i}\n' for i in range(5)))
+                archive.writestr('README.txt', 'not an agency file')
+                archive.writestr('agency-2.csv', 'fi"rst,last,20000000,2000-12-21,7574\r\nfirst,last,20000001,2000-12-22,1\r\n')
+            # small chunks so every file is split across several workers
+            self.assertEqual(7, bulk_import([path], 2, 40))
+        bets = list(load_bets())
+        self.assertEqual([1] * 5 + [2] * 2, [bet.agency for bet in bets])
+        self.assertEqual([f'1000000{i}' for i in range(5)] + ['20000000', '20000001'], [bet.document for bet in bets])
+        self.assertEqual('fi"rst', bets[5].first_name)
+        self.assertEqual(datetime.date(2000, 12, 22), bets[6].birthdate)
+
+    def test_bulk_import_checks_every_path_before_storing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            valid = os.path.join(tmpdir, 'agency-1.csv')
+            invalid = os.path.join(tmpdir, 'bets.csv')
+            for path in (valid, invalid):
+                with open(path, 'wb') as file:
+                    file.write(b'first,last,10000000,2000-12-20,7500\n')
+            with self.assertRaises(ValueError):
+                bulk_import([valid, invalid], 1, 1024)
+            with self.assertRaises(FileNotFoundError):
+                bulk_import([valid, os.path.join(tmpdir, 'agency-2.csv')], 1, 1024)
+        self.assertFalse(os.path.exists(STORAGE_FILEPATH))
+
 if __name__ == '__main__':
     unittest.main()
 
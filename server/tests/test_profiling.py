@@ -0,0 +1,69 @@
+from lib.profiling import Profiler
+import os
+import tempfile
+import unittest
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_stage_counts_calls_and_total_time(self):
+        profiler = Profiler('test', [Profiler.TIMERS], self.output_dir.name)
+        for _ in range(3):
+            with profiler.stage('recv'):
+                pass
+        count, total, longest = profiler.stats['recv']
+        self.assertEqual(3, count)
+        self.assertGreaterEqual(total, longest)
+        self.assertGreater(longest, 0)
+
+    def test_stage_keeps_longest_time(self):
+        profiler = Profiler('test', [Profiler.TIMERS], self.output_dir.name)
+        with profiler.stage('store'):
+            sum(range(100000))
+        longest = profiler.stats['store'][2]
+        with profiler.stage('store'):
+            pass
+        self.assertEqual(longest, profiler.stats['store'][2])
+
+    def test_stage_without_timers_keeps_no_stats(self):
+        profiler = Profiler('test', [], self.output_dir.name)
+        with profiler.stage('recv'):
+            pass
+        self.assertEqual({}, profiler.stats)
+
+    def test_flush_merges_stats_into_shared_memory(self):
+        profiler = Profiler('test', [Profiler.TIMERS], self.output_dir.name)
+        profiler.share(['recv', 'store'])
+        profiler.stats['recv'] = [2, 0.5, 0.3]
+        profiler.flush()
+        profiler.stats['recv'] = [1, 0.25, 0.25]
+        profiler.flush()
+        self.assertEqual({}, profiler.stats)
+        self.assertEqual([3, 0.75, 0.3, 0, 0, 0], list(profiler.shared))
+
+    def test_report_writes_every_stage(self):
+        profiler = Profiler('test', [Profiler.TIMERS], self.output_dir.name)
+        profiler.share(['recv'])
+        profiler.stats['recv'] = [4, 2.0, 1.0]
+        profiler.flush()
+        profiler.stats['accept'] = [1, 0.5, 0.5]
+        profiler.report()
+        with open(os.path.join(self.output_dir.name, 'test-summary.txt')) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertIn('stage: accept | count: 1 | total_s: 0.500000 | mean_ms: 500.000 | max_ms: 500.000', lines[0])
+        self.assertIn('stage: recv | count: 4 | total_s: 2.000000 | mean_ms: 500.000 | max_ms: 1000.000', lines[1])
+
+    def test_parse_modes_rejects_unsupported_modes(self):
+        self.assertEqual([Profiler.TIMERS, Profiler.CPROFILE], Profiler.parse_modes(' timers, cprofile ,'))
+        self.assertEqual([], Profiler.parse_modes(''))
+        with self.assertRaises(ValueError):
+            Profiler.parse_modes('timers,timer')
+
+if __name__ == '__main__':
+    unittest.main()